@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import sqlite3, time, math, json, os, sys
+import os, sqlite3, time, json, sys
 from datetime import datetime, timezone
 
 DB_PATH = "/media/sbejarano/Developer1/wifi_promiscuous/tmp/wifi_logs.db"  # adjust
@@ -11,8 +11,8 @@ INSERT INTO wifi_ap_position (
   bssid, lat, lon, err_m, confidence, best_score,
   last_seen_utc, best_seen_utc, last_rssi, last_channel, side, updates
 ) VALUES (
-  :bssid, :lat, :lon, :err_m, :confidence, :best_score,
-  :last_seen_utc, :best_seen_utc, :last_rssi, :last_channel, :side, 1
+  ?, ?, ?, ?, ?, ?,
+  ?, ?, ?, ?, ?, 1
 )
 ON CONFLICT(bssid) DO UPDATE SET
   last_seen_utc = excluded.last_seen_utc,
@@ -45,6 +45,13 @@ def connect_db(path: str) -> sqlite3.Connection:
     con.execute("PRAGMA synchronous=NORMAL;")
     con.execute("PRAGMA temp_store=MEMORY;")
     con.execute("PRAGMA busy_timeout=5000;")
+    # This is the only writer of wifi_logs.db: at most one upsert batch per
+    # POLL_S, rewriting the same AP rows. 4000 pages (~16 MiB of WAL at the
+    # 4 KiB default page size) checkpoints a few times a minute at most
+    # instead of every few polls.
+    con.execute("PRAGMA wal_autocheckpoint=4000;")   # pages; default 1000
+    con.execute("PRAGMA cache_size=-65536;")          # 64 MiB page cache
+    con.execute("PRAGMA mmap_size=268435456;")        # 256 MiB
     return con
 
 def ensure_schema(con: sqlite3.Connection):
@@ -75,73 +82,85 @@ def read_json(path: str):
         print(f"[writer] JSON read error: {e}", file=sys.stderr)
         return None
 
-def write_one(con: sqlite3.Connection, row: dict):
+# bssid, lat, lon, err_m, confidence -- fetched in one map(row.get, ...)
+REQUIRED_FIELDS = ("bssid", "lat", "lon", "err_m", "confidence")
+
+def build_params(row: dict, now: str):
     # Required fields from your trilateration output:
     # bssid, lat, lon, err_m, confidence, rssi, channel, side
-    bssid = row.get("bssid")
+    bssid, lat, lon, err_m, conf = map(row.get, REQUIRED_FIELDS)
     if not bssid:
-        return
-
-    lat = row.get("lat"); lon = row.get("lon")
-    err_m = row.get("err_m"); conf = row.get("confidence")
+        return None
 
     # Reject obviously bad points, but LOG them if needed
     if lat is None or lon is None or err_m is None or conf is None:
-        return
-    if not (-90.0 <= float(lat) <= 90.0 and -180.0 <= float(lon) <= 180.0):
-        return
-    if float(err_m) <= 0:
-        return
+        return None
+    lat = float(lat); lon = float(lon)
+    err_m = float(err_m); conf = float(conf)
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+    if err_m <= 0:
+        return None
 
-    now = utc_iso()
     score = best_score(conf, err_m)
 
-    params = {
-        "bssid": bssid,
-        "lat": float(lat),
-        "lon": float(lon),
-        "err_m": float(err_m),
-        "confidence": float(conf),
-        "best_score": float(score),
-        "last_seen_utc": now,
-        "best_seen_utc": now,
-        "last_rssi": row.get("avg_rssi") if "avg_rssi" in row else row.get("rssi"),
-        "last_channel": row.get("dominant_channel") if "dominant_channel" in row else row.get("channel"),
-        "side": row.get("side", "UNKNOWN"),
-    }
-
-    # Retry on lock without killing the loop
-    for attempt in range(1, 6):
-        try:
-            con.execute("BEGIN;")
-            con.execute(UPSERT_SQL, params)
-            con.execute("COMMIT;")
-            return
-        except sqlite3.OperationalError as e:
-            con.execute("ROLLBACK;")
-            msg = str(e).lower()
-            if "locked" in msg or "busy" in msg:
-                time.sleep(0.1 * attempt)
-                continue
-            print(f"[writer] OperationalError bssid={bssid} err={e}", file=sys.stderr)
-            return
-        except Exception as e:
-            try: con.execute("ROLLBACK;")
-            except Exception: pass
-            print(f"[writer] Write error bssid={bssid} err_m={err_m} conf={conf} score={score} err={e}", file=sys.stderr)
-            return
+    # same order as the INSERT column list in UPSERT_SQL
+    return (
+        bssid,
+        lat,
+        lon,
+        err_m,
+        conf,
+        score,
+        now,                                        # last_seen_utc
+        now,                                        # best_seen_utc
+        row.get("avg_rssi") if "avg_rssi" in row else row.get("rssi"),
+        row.get("dominant_channel") if "dominant_channel" in row else row.get("channel"),
+        row.get("side", "UNKNOWN"),
+    )
+
+def flush_batch(con: sqlite3.Connection, batch: list):
+    # One transaction (one WAL commit) per poll instead of one per AP
+    if not batch:
+        return
+
+    # BEGIN IMMEDIATE takes the write lock up front; contention is waited
+    # out by SQLite's busy handler (busy_timeout), not by Python sleeps.
+    # A batch that still fails is logged; the next input update rewrites it.
+    try:
+        con.execute("BEGIN IMMEDIATE;")
+        con.executemany(UPSERT_SQL, batch)
+        con.execute("COMMIT;")
+    except Exception as e:
+        try: con.execute("ROLLBACK;")
+        except Exception: pass
+        print(f"[writer] Write error rows={len(batch)} err={e}", file=sys.stderr)
 
 def main():
     con = connect_db(DB_PATH)
     ensure_schema(con)
 
     last_ts = None
+    last_key = None
 
     while True:
+        # Skip the open+parse while the producer hasn't replaced the file.
+        # (inode, mtime) change check, as in wifi_capture_service.read_gps.
+        try:
+            st = os.stat(SRC_JSON)
+            key = (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            key = None
+        if key is None or key == last_key:
+            time.sleep(POLL_S)
+            continue
+        last_key = None
+
         data = read_json(SRC_JSON)
         if not data:
             time.sleep(POLL_S)
             continue
+        last_key = key
 
         # If your json includes a timestamp, use it to avoid reprocessing duplicates
         ts = data.get("ts") or data.get("_ts")
@@ -154,8 +173,10 @@ def main():
         if isinstance(rows, dict):
             rows = [rows]
 
-        for r in rows:
-            write_one(con, r)
+        # one timestamp per poll; every row in it shares the same second
+        now = utc_iso()
+        batch = [p for p in (build_params(r, now) for r in rows) if p is not None]
+        flush_batch(con, batch)
 
         time.sleep(POLL_S)
 
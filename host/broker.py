@@ -1,11 +1,24 @@
-# broker.py  (optional live view; NO DB; no split files)
 #!/usr/bin/env python3
+# broker.py  (optional live view; NO DB; no split files)
 import os
 import json
 import time
 import yaml
 from collections import defaultdict, deque
 
+try:
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 BASE = "/home/sbejarano/wifi_promiscuous"
 INP  = "/dev/shm/wifi_capture.json"
 
@@ -14,28 +27,85 @@ DENY = f"{BASE}/host/denied_ssid.yaml"
 
 STALE_SEC  = 10.0
 WINDOW_SEC = 10.0
+HIST_MAX   = 256    # samples kept per BSSID, even within WINDOW_SEC
 
 def atomic_write_json(path, obj):
     tmp = path + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(obj, f, separators=(",", ":"))
+    with open(tmp, "wb") as f:
+        f.write(json_dumps(obj))
     os.replace(tmp, path)
 
 def load_denied():
     try:
         with open(DENY) as f:
-            d = yaml.safe_load(f) or {}
+            d = yaml.load(f, Loader=YamlLoader) or {}
             return set(d.get("deny", []) or [])
     except Exception:
         return set()
 
+_cap_key = None
+
 def read_capture():
+    # None when the snapshot hasn't been replaced since the last call,
+    # so an unchanged file is neither re-parsed nor re-counted.
+    # (inode, mtime) change check, as in wifi_capture_service.read_gps.
+    global _cap_key
     try:
-        with open(INP) as f:
-            return json.load(f)
+        st = os.stat(INP)
+        key = (st.st_ino, st.st_mtime_ns)
+        if key == _cap_key:
+            return None
+        _cap_key = None
+        with open(INP, "rb") as f:
+            cap = json_loads(f.read())
+        _cap_key = key
+        return cap
     except Exception:
         return None
 
+class History:
+    # Samples for one BSSID plus running RSSI sums, updated as samples
+    # enter and leave the window, so a pass needs no scan of the deque.
+    def __init__(self):
+        self.dq = deque(maxlen=HIST_MAX)
+        self.rssi_sum = 0
+        self.left_sum = self.left_n = 0
+        self.right_sum = self.right_n = 0
+
+    def _count(self, item, sign):
+        node, rssi = item[1], item[2]
+        self.rssi_sum += sign * rssi
+        if node == "LEFT":
+            self.left_sum += sign * rssi
+            self.left_n += sign
+        elif node == "RIGHT":
+            self.right_sum += sign * rssi
+            self.right_n += sign
+
+    def append(self, item):
+        dq = self.dq
+        if len(dq) == HIST_MAX:
+            # the deque is about to evict its oldest sample
+            self._count(dq[0], -1)
+        dq.append(item)
+        self._count(item, 1)
+
+    def prune(self, now):
+        dq = self.dq
+        while dq and (now - dq[0][0]) > WINDOW_SEC:
+            self._count(dq.popleft(), -1)
+
+    def side(self):
+        ln, rn = self.left_n, self.right_n
+        if ln and rn:
+            # compare the two means without dividing
+            return "LEFT" if self.left_sum * rn > self.right_sum * ln else "RIGHT"
+        if ln:
+            return "LEFT"
+        if rn:
+            return "RIGHT"
+        return "OMNI"
+
 def is_hidden(ssid: str) -> bool:
     if not ssid:
         return True
@@ -46,7 +116,7 @@ def main():
     denied = load_denied()
 
     # history per BSSID of (ts, node, rssi, channel, ssid)
-    hist = defaultdict(lambda: deque())
+    hist = defaultdict(History)
 
     while True:
         cap = read_capture()
@@ -69,15 +139,14 @@ def main():
                     if ssid in denied:
                         continue
 
-                    dq = hist[bssid]
-                    dq.append((ts, node, int(rssi), ch, ssid))
+                    hist[bssid].append((ts, node, int(rssi), ch, ssid))
                 except Exception:
                     continue
 
         devices = []
-        for bssid, dq in list(hist.items()):
-            while dq and (now - dq[0][0]) > WINDOW_SEC:
-                dq.popleft()
+        for bssid, h in list(hist.items()):
+            h.prune(now)
+            dq = h.dq
 
             if not dq:
                 hist.pop(bssid, None)
@@ -90,21 +159,8 @@ def main():
 
             ssid = dq[-1][4]
             ch   = dq[-1][3]
-
-            rssi_vals = [x[2] for x in dq if isinstance(x[2], int)]
-            rssi = int(sum(rssi_vals) / len(rssi_vals)) if rssi_vals else None
-
-            left  = [x[2] for x in dq if x[1] == "LEFT"]
-            right = [x[2] for x in dq if x[1] == "RIGHT"]
-
-            if left and right:
-                side = "LEFT" if (sum(left)/len(left)) > (sum(right)/len(right)) else "RIGHT"
-            elif left:
-                side = "LEFT"
-            elif right:
-                side = "RIGHT"
-            else:
-                side = "OMNI"
+            rssi = int(h.rssi_sum / len(dq))
+            side = h.side()
 
             devices.append({
                 "bssid": bssid,
@@ -16,9 +16,11 @@ Capture-only DB writer with safe schema initialization and runtime rotation.
 import glob
 import json
 import os
+import signal
 import sqlite3
+import sys
 import time
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from datetime import datetime, timezone
 
 BASE = "/home/sbejarano/wifi_promiscuous"
@@ -40,31 +42,38 @@ DISCRIMINATOR_TTL_S = 12.0
 # Prevent duplicate writes from the rolling /dev/shm buffer.
 SEEN_CACHE_LIMIT = 75000
 
-UPSERT_SQL = """
-INSERT INTO wifi_captures (
-  ts_utc, bssid, ssid, sample_count, median_rssi, avg_rssi,
-  dominant_channel, frequency_mhz,
-  est_lat, est_lon, est_alt, accuracy_m,
-  left_rssi, right_rssi, differential, side, side_confidence,
-  gps_lat_min, gps_lat_max, gps_lon_min, gps_lon_max,
-  last_seen_ts,
-  gps_ts_utc, gps_track_deg, gps_speed_mps,
-  gps_heading_deg, gps_heading_valid, gps_speed_knots,
-  gps_stationary, gps_valid, gps_pdop, gps_hdop, gps_vdop,
-  gps_monotonic_ts
-) VALUES (
-  :ts_utc, :bssid, :ssid, :sample_count, :median_rssi, :avg_rssi,
-  :dominant_channel, :frequency_mhz,
-  :est_lat, :est_lon, :est_alt, :accuracy_m,
-  :left_rssi, :right_rssi, :differential, :side, :side_confidence,
-  :gps_lat_min, :gps_lat_max, :gps_lon_min, :gps_lon_max,
-  :last_seen_ts,
-  :gps_ts_utc, :gps_track_deg, :gps_speed_mps,
-  :gps_heading_deg, :gps_heading_valid, :gps_speed_knots,
-  :gps_stationary, :gps_valid, :gps_pdop, :gps_hdop, :gps_vdop,
-  :gps_monotonic_ts
-);
-"""
+# Rows from consecutive snapshots are committed together once either
+# limit is reached, so the WAL is synced about once a second.
+COMMIT_ROWS = 20000
+COMMIT_INTERVAL_S = 1.0
+# Rows kept for retry after a failed commit; the oldest are dropped past this.
+PENDING_MAX_ROWS = 5 * COMMIT_ROWS
+
+# Per-snapshot status lines are flushed at most this often, and the
+# no-fix warning is repeated at most this often.
+LOG_FLUSH_S = 1.0
+GPS_BLOCK_LOG_S = 5.0
+
+# Column order of every row tuple built by aggregate_rows().
+CAPTURE_COLUMNS = (
+    "ts_utc", "bssid", "ssid", "sample_count", "median_rssi", "avg_rssi",
+    "dominant_channel", "frequency_mhz",
+    "est_lat", "est_lon", "est_alt", "accuracy_m",
+    "left_rssi", "right_rssi", "differential", "side", "side_confidence",
+    "gps_lat_min", "gps_lat_max", "gps_lon_min", "gps_lon_max",
+    "last_seen_ts",
+    "gps_ts_utc", "gps_track_deg", "gps_speed_mps",
+    "gps_heading_deg", "gps_heading_valid", "gps_speed_knots",
+    "gps_stationary", "gps_valid", "gps_pdop", "gps_hdop", "gps_vdop",
+    "gps_monotonic_ts",
+)
+
+# Positional placeholders bind straight from the row tuples; named ones
+# make sqlite3 look every parameter up in a per-row dict.
+UPSERT_SQL = (
+    f"INSERT INTO wifi_captures ({', '.join(CAPTURE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(CAPTURE_COLUMNS))});"
+)
 
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS wifi_captures (
@@ -113,8 +122,55 @@ CREATE INDEX IF NOT EXISTS idx_wificap_side ON wifi_captures(side);
 """
 
 
+# Row timestamps have one-second resolution and repeat heavily within a
+# snapshot, so formatted strings are kept for recent seconds.
+ISO_CACHE_LIMIT = 64
+_iso_cache = {}
+
+
+def iso_seconds(sec):
+    s = _iso_cache.get(sec)
+
+    if s is None:
+        if len(_iso_cache) >= ISO_CACHE_LIMIT:
+            _iso_cache.clear()
+
+        # same text as datetime.isoformat(timespec="seconds") in UTC,
+        # without building a tz-aware datetime per second
+        s = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(sec))
+        _iso_cache[sec] = s
+
+    return s
+
+
 def utc_now_iso():
-    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+    return iso_seconds(int(time.time()))
+
+
+_last_log_flush = 0.0
+_last_gps_block_log = 0.0
+
+
+def maybe_flush_log():
+    global _last_log_flush
+
+    now = time.monotonic()
+
+    if now - _last_log_flush >= LOG_FLUSH_S:
+        sys.stdout.flush()
+        _last_log_flush = now
+
+
+def log_gps_block(msg):
+    # Without a fix every snapshot is blocked; don't repeat the same
+    # warning four times a second.
+    global _last_gps_block_log
+
+    now = time.monotonic()
+
+    if now - _last_gps_block_log >= GPS_BLOCK_LOG_S:
+        print(msg)
+        _last_gps_block_log = now
 
 
 def db_stamp():
@@ -199,21 +255,110 @@ def ensure_columns(con):
 
 
 def connect_db(db_path):
+    # A freshly created file gets the full schema from SCHEMA_SQL, so the
+    # column migration probe is only needed when reopening an older DB.
+    fresh = not os.path.exists(db_path)
+
     con = sqlite3.connect(
         db_path,
         timeout=5.0,
-        isolation_level=None
+        isolation_level=None,
+        cached_statements=128
     )
 
+    if fresh:
+        # Page size can only change before the first table exists and
+        # before the file switches to WAL.
+        con.execute("PRAGMA page_size=8192;")
+
     con.execute("PRAGMA journal_mode=WAL;")
     con.execute("PRAGMA synchronous=NORMAL;")
     con.execute("PRAGMA busy_timeout=5000;")
+    con.execute("PRAGMA temp_store=MEMORY;")
+    con.execute("PRAGMA wal_autocheckpoint=2000;")
+    con.execute("PRAGMA cache_size=-65536;")
+    con.execute("PRAGMA mmap_size=268435456;")
     con.executescript(SCHEMA_SQL)
-    ensure_columns(con)
+
+    if not fresh:
+        ensure_columns(con)
 
     return con
 
 
+def write_rows(con, rows):
+    # The connection runs in autocommit mode, so a bare executemany
+    # commits (and syncs the WAL) once per row. Wrap the whole snapshot
+    # in a single transaction instead.
+    con.execute("BEGIN IMMEDIATE;")
+
+    # COMMIT is inside the guard too: a failed COMMIT must not leave the
+    # connection in a transaction, or every later BEGIN would fail.
+    try:
+        con.executemany(UPSERT_SQL, rows)
+        con.execute("COMMIT;")
+    except BaseException:
+        if con.in_transaction:
+            con.execute("ROLLBACK;")
+        raise
+
+
+class RowBuffer:
+    def __init__(self):
+        self.rows = []
+        self.last_commit = time.monotonic()
+
+    def add(self, rows):
+        self.rows.extend(rows)
+
+    def flush(self, con, force=False):
+        now = time.monotonic()
+
+        if not self.rows:
+            self.last_commit = now
+            return
+
+        if (
+            not force
+            and len(self.rows) < COMMIT_ROWS
+            and now - self.last_commit < COMMIT_INTERVAL_S
+        ):
+            return
+
+        rows, self.rows = self.rows, []
+        self.last_commit = now
+
+        try:
+            write_rows(con, rows)
+        except BaseException:
+            # keep the batch for the next flush, bounded so a database
+            # that stays unwritable cannot grow the buffer forever
+            self.rows[:0] = rows
+            dropped = len(self.rows) - PENDING_MAX_ROWS
+
+            if dropped > 0:
+                del self.rows[:dropped]
+                print(
+                    f"[db_writer] commit failed, dropped {dropped} oldest rows",
+                    flush=True
+                )
+
+            raise
+
+
+def flush_pending(pending, con, force=False):
+    # A commit failure must not stop the loop: the rows stay buffered
+    # (bounded by PENDING_MAX_ROWS) and snapshots keep being read.
+    try:
+        pending.flush(con, force=force)
+    except Exception as e:
+        print(
+            f"[db_writer] commit error: {e} "
+            f"({len(pending.rows)} rows pending)",
+            flush=True
+        )
+
+
 def read_json(path):
     try:
         with open(path, "r") as f:
@@ -285,14 +430,8 @@ def obs_time(o, fallback=None):
     return t
 
 
-def obs_seen_key(o):
-    return (
-        normalize_node(o.get("node")),
-        normalize_bssid(o.get("bssid")),
-        normalize_channel(o.get("channel")),
-        safe_int(o.get("rssi")),
-        round(obs_time(o), 3),
-    )
+# One snapshot observation, normalized once when first seen.
+Obs = namedtuple("Obs", "node bssid channel rssi ts ssid has_freq freq")
 
 
 def gps_value(gps, *names):
@@ -511,11 +650,10 @@ def aggregate_rows(payload, seen_obs_keys, discriminator_cache):
 
     if not gps_valid:
         if observations:
-            print(
+            log_gps_block(
                 f"[db_writer] GPS BLOCK: "
                 f"gps_valid={gps_valid}; "
-                f"skipping {len(observations)} observations",
-                flush=True
+                f"skipping {len(observations)} observations"
             )
         return []
 
@@ -526,16 +664,16 @@ def aggregate_rows(payload, seen_obs_keys, discriminator_cache):
 
     if gps_lat is None or gps_lon is None:
         if observations:
-            print(
+            log_gps_block(
                 f"[db_writer] GPS BLOCK: "
                 f"gps_valid={gps_valid}; "
                 f"lat={gps_lat}; lon={gps_lon}; "
-                f"skipping {len(observations)} observations",
-                flush=True
+                f"skipping {len(observations)} observations"
             )
         return []
 
     new_obs = []
+    payload_ts = payload.get("ts")
 
     for o in observations:
         bssid = normalize_bssid(o.get("bssid"))
@@ -544,13 +682,39 @@ def aggregate_rows(payload, seen_obs_keys, discriminator_cache):
         if not bssid or rssi is None:
             continue
 
-        key = obs_seen_key(o)
+        node = normalize_node(o.get("node"))
+        ch = normalize_channel(o.get("channel"))
+        ts = safe_float(o.get("ts"))
+
+        key = (
+            node,
+            bssid,
+            ch,
+            rssi,
+            round(ts if ts is not None else time.time(), 3),
+        )
 
         if key in seen_obs_keys:
             continue
 
         seen_obs_keys.add(key)
-        new_obs.append(o)
+
+        if ts is None:
+            ts = obs_time(o, payload_ts)
+
+        freq_mhz = o.get("frequency_mhz")
+        freq = o.get("frequency")
+
+        new_obs.append(Obs(
+            node=node,
+            bssid=bssid,
+            channel=ch,
+            rssi=rssi,
+            ts=ts,
+            ssid=(o.get("ssid") or "").strip(),
+            has_freq=freq_mhz is not None or freq is not None,
+            freq=freq_mhz or freq,
+        ))
 
     if not new_obs:
         return []
@@ -560,35 +724,21 @@ def aggregate_rows(payload, seen_obs_keys, discriminator_cache):
         seen_obs_keys.clear()
         seen_obs_keys.update(trimmed)
 
-    for o in new_obs:
-        node = normalize_node(o.get("node"))
-
-        if node in DIRECTIONAL_NODES:
-            discriminator_cache.update(
-                node=node,
-                bssid=o.get("bssid"),
-                channel=o.get("channel"),
-                rssi=o.get("rssi"),
-                ts=obs_time(o, payload.get("ts")),
-            )
-
-    discriminator_cache.prune(payload.get("ts") or time.time())
-
     primary_groups = defaultdict(list)
 
     for o in new_obs:
-        node = normalize_node(o.get("node"))
-
-        if node in DIRECTIONAL_NODES:
-            continue
-
-        bssid = normalize_bssid(o.get("bssid"))
-        ch = normalize_channel(o.get("channel"))
-
-        if not bssid:
-            continue
+        if o.node in DIRECTIONAL_NODES:
+            discriminator_cache.update(
+                node=o.node,
+                bssid=o.bssid,
+                channel=o.channel,
+                rssi=o.rssi,
+                ts=o.ts,
+            )
+        else:
+            primary_groups[(o.bssid, o.channel)].append(o)
 
-        primary_groups[(bssid, ch)].append(o)
+    discriminator_cache.prune(payload_ts or time.time())
 
     if not primary_groups:
         return []
@@ -635,48 +785,46 @@ def aggregate_rows(payload, seen_obs_keys, discriminator_cache):
         "gps_monotonic_ts"
     )
 
-    rows = []
+    # GPS columns are the same for every row of a snapshot; build them once.
+    ts_utc = utc_now_iso()
 
-    for (bssid, grouped_channel), primary_samples in primary_groups.items():
-        rssis = [
-            safe_int(s.get("rssi"))
-            for s in primary_samples
-            if safe_int(s.get("rssi")) is not None
-        ]
+    gps_est = (gps_lat, gps_lon, gps_alt, gps_accuracy)
+    gps_bounds = (gps_lat, gps_lat, gps_lon, gps_lon)
 
-        if not rssis:
-            continue
+    gps_tail = (
+        gps_ts_utc,
+        gps_track_deg,
+        gps_speed_mps,
 
-        channels = [
-            normalize_channel(s.get("channel"))
-            for s in primary_samples
-            if normalize_channel(s.get("channel")) is not None
-        ]
+        gps_heading_deg,
+        to_bool_int(gps_heading_valid),
 
-        ch_counts = defaultdict(int)
+        gps_speed_knots,
+        to_bool_int(gps_stationary),
+        1,
 
-        for ch in channels:
-            ch_counts[ch] += 1
+        gps_pdop,
+        gps_hdop,
+        gps_vdop,
+        gps_monotonic_ts,
+    )
 
-        dominant_channel = (
-            max(ch_counts, key=ch_counts.get)
-            if ch_counts else grouped_channel
-        )
+    rows = []
+    side_counts = defaultdict(int)
+
+    for (bssid, grouped_channel), primary_samples in primary_groups.items():
+        rssis = [s.rssi for s in primary_samples]
+
+        # Samples are grouped by normalized channel, so the group key is
+        # already the dominant channel.
+        dominant_channel = grouped_channel
 
         frequency_mhz = next(
-            (
-                s.get("frequency_mhz") or s.get("frequency")
-                for s in reversed(primary_samples)
-                if s.get("frequency_mhz") is not None
-                or s.get("frequency") is not None
-            ),
+            (s.freq for s in reversed(primary_samples) if s.has_freq),
             None
         )
 
-        last_seen = max(
-            obs_time(s, payload.get("ts"))
-            for s in primary_samples
-        )
+        last_seen = max(s.ts for s in primary_samples)
 
         side, left_rssi, right_rssi, diff, side_conf = discriminator_cache.get(
             bssid=bssid,
@@ -685,76 +833,40 @@ def aggregate_rows(payload, seen_obs_keys, discriminator_cache):
         )
 
         ssid = next(
-            (
-                (s.get("ssid") or "").strip()
-                for s in reversed(primary_samples)
-                if (s.get("ssid") or "").strip()
-            ),
+            (s.ssid for s in reversed(primary_samples) if s.ssid),
             None
         )
 
-        rows.append({
-            "ts_utc": utc_now_iso(),
-            "bssid": bssid,
-            "ssid": ssid,
-            "sample_count": len(rssis),
-            "median_rssi": median(rssis),
-            "avg_rssi": float(sum(rssis) / len(rssis)),
-            "dominant_channel": dominant_channel,
-            "frequency_mhz": frequency_mhz,
-
-            "est_lat": gps_lat,
-            "est_lon": gps_lon,
-            "est_alt": gps_alt,
-            "accuracy_m": gps_accuracy,
-
-            "left_rssi": left_rssi,
-            "right_rssi": right_rssi,
-            "differential": diff,
-            "side": side,
-            "side_confidence": side_conf,
-
-            "gps_lat_min": gps_lat,
-            "gps_lat_max": gps_lat,
-            "gps_lon_min": gps_lon,
-            "gps_lon_max": gps_lon,
-
-            "last_seen_ts": datetime.fromtimestamp(
-                last_seen,
-                tz=timezone.utc
-            ).isoformat(timespec="seconds"),
-
-            "gps_ts_utc": gps_ts_utc,
-            "gps_track_deg": gps_track_deg,
-            "gps_speed_mps": gps_speed_mps,
-
-            "gps_heading_deg": gps_heading_deg,
-            "gps_heading_valid": to_bool_int(gps_heading_valid),
-
-            "gps_speed_knots": gps_speed_knots,
-            "gps_stationary": to_bool_int(gps_stationary),
-            "gps_valid": 1,
-
-            "gps_pdop": gps_pdop,
-            "gps_hdop": gps_hdop,
-            "gps_vdop": gps_vdop,
-            "gps_monotonic_ts": gps_monotonic_ts,
-        })
+        side_counts[side] += 1
+
+        rows.append((
+            ts_utc,
+            bssid,
+            ssid,
+            len(rssis),
+            median(rssis),
+            float(sum(rssis) / len(rssis)),
+            dominant_channel,
+            frequency_mhz,
+            *gps_est,
+            left_rssi,
+            right_rssi,
+            diff,
+            side,
+            side_conf,
+            *gps_bounds,
+            iso_seconds(int(last_seen)),
+            *gps_tail,
+        ))
 
     if rows:
-        side_counts = defaultdict(int)
-
-        for r in rows:
-            side_counts[r["side"]] += 1
-
         print(
             "[db_writer] rows="
             f"{len(rows)} "
             f"LEFT={side_counts.get('LEFT', 0)} "
             f"RIGHT={side_counts.get('RIGHT', 0)} "
             f"OMNI={side_counts.get('OMNI', 0)} "
-            f"disc_cache={len(discriminator_cache.cache)}",
-            flush=True
+            f"disc_cache={len(discriminator_cache.cache)}"
         )
 
     return rows
@@ -792,57 +904,86 @@ def open_new_db():
     return con, db_path, opened_day
 
 
+def handle_term(signum, frame):
+    # Unwind through main()'s finally so buffered rows are committed.
+    raise SystemExit(0)
+
+
 def main():
+    signal.signal(signal.SIGTERM, handle_term)
+
     con, db_path, opened_day = open_new_db()
 
     last_src_ts = None
     seen_obs_keys = set()
     discriminator_cache = DiscriminatorCache(DISCRIMINATOR_TTL_S)
+    pending = RowBuffer()
 
-    while True:
-        try:
-            if should_rotate(db_path, opened_day):
-                try:
-                    con.close()
-                except Exception:
-                    pass
+    try:
+        while True:
+            maybe_flush_log()
 
-                con, db_path, opened_day = open_new_db()
-                seen_obs_keys.clear()
-                discriminator_cache = DiscriminatorCache(DISCRIMINATOR_TTL_S)
+            try:
+                flush_pending(pending, con)
 
-            payload = read_json(SRC)
+                if should_rotate(db_path, opened_day):
+                    # rows the old file would not take are carried over
+                    # and committed to the new one
+                    flush_pending(pending, con, force=True)
 
-            if not payload:
-                time.sleep(POLL_S)
-                continue
+                    try:
+                        con.close()
+                    except Exception:
+                        pass
 
-            src_ts = payload.get("ts")
+                    con, db_path, opened_day = open_new_db()
+                    seen_obs_keys.clear()
+                    discriminator_cache = DiscriminatorCache(DISCRIMINATOR_TTL_S)
 
-            if src_ts is not None and src_ts == last_src_ts:
-                time.sleep(POLL_S)
-                continue
+                payload = read_json(SRC)
 
-            last_src_ts = src_ts
+                if not payload:
+                    time.sleep(POLL_S)
+                    continue
 
-            rows = aggregate_rows(
-                payload,
-                seen_obs_keys,
-                discriminator_cache
-            )
+                src_ts = payload.get("ts")
+
+                if src_ts is not None and src_ts == last_src_ts:
+                    time.sleep(POLL_S)
+                    continue
 
-            if rows:
-                con.executemany(UPSERT_SQL, rows)
+                last_src_ts = src_ts
 
-            time.sleep(POLL_S)
+                rows = aggregate_rows(
+                    payload,
+                    seen_obs_keys,
+                    discriminator_cache
+                )
 
+                if rows:
+                    pending.add(rows)
+
+                time.sleep(POLL_S)
+
+            except Exception as e:
+                print(
+                    f"[db_writer] loop error: {e}",
+                    flush=True
+                )
+                time.sleep(1)
+
+    finally:
+        flush_pending(pending, con, force=True)
+
+        try:
+            con.close()
         except Exception as e:
             print(
-                f"[db_writer] loop error: {e}",
+                f"[db_writer] shutdown close error: {e}",
                 flush=True
             )
-            time.sleep(1)
 
+        sys.stdout.flush()
 
 if __name__ == "__main__":
     main()
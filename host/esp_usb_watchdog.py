@@ -4,7 +4,7 @@ import time
 import json
 import glob
 import subprocess
-from datetime import datetime
+from datetime import datetime, timezone
 
 # ================= CONFIG =================
 CAPTURE_FILE = "/var/www/html/wifi/data/wifi_capture.json"
@@ -26,7 +26,8 @@ def now():
 
 
 def iso(ts):
-    return datetime.utcfromtimestamp(ts).isoformat() + "Z"
+    # utcfromtimestamp() is deprecated; keep the naive "...Z" text
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat() + "Z"
 
 
 def log(*msg):
@@ -68,8 +69,24 @@ def usb_reset(dev):
         return False
 
 
+_capture_key = None
+
+
 def scan_capture():
+    global _capture_key
+
+    # An unchanged file would yield the same last_seen; keep it as is.
+    # (inode, mtime) change check, as in wifi_capture_service.read_gps.
+    try:
+        st = os.stat(CAPTURE_FILE)
+        key = (st.st_ino, st.st_mtime_ns)
+    except OSError:
+        key = None
+    if key is not None and key == _capture_key:
+        return
+
     last_seen.clear()
+    _capture_key = None
 
     try:
         with open(CAPTURE_FILE) as f:
@@ -77,6 +94,8 @@ def scan_capture():
     except Exception:
         return
 
+    _capture_key = key
+
     # Expecting per-node timestamps inside capture
     for node, info in data.get("nodes", {}).items():
         ts = info.get("ts")
@@ -5,19 +5,39 @@ import time
 import os
 from datetime import datetime, timezone
 
+try:
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
 OUT = "/media/sbejarano/Developer1/wifi_promiscuous/tmp/gps.json"
 
 # --- tuning parameters ---
 MIN_SPEED_MPS = 1.0      # below this, track is unreliable
-WRITE_INTERVAL = 0.05    # seconds
+WRITE_INTERVAL = 0.05    # min seconds between non-TPV writes
+
+# gpsd always emits "class" as the first key, so the report type can be
+# read from the line prefix before paying for a full JSON parse.
+CLASS_PREFIX = b'{"class":"'
+HANDLED_CLASSES = {"PPS", "SKY", "TPV"}
+
+def line_class(line):
+    if not line.startswith(CLASS_PREFIX):
+        return None
+    start = len(CLASS_PREFIX)
+    end = line.find(b'"', start)
+    return line[start:end].decode("ascii", "ignore") if end != -1 else None
 
 def utc_iso():
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
 def atomic_write_json(path, obj):
     tmp = path + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(obj, f)
+    with open(tmp, "wb") as f:
+        f.write(json_dumps(obj))
     os.replace(tmp, path)
 
 def main():
@@ -25,7 +45,9 @@ def main():
         ["gpspipe", "-w"],
         stdout=subprocess.PIPE,
         stderr=subprocess.DEVNULL,
-        text=True
+        # binary pipe: lines are split in C and handed to the JSON
+        # parser as bytes, with no text decoding layer in between
+        bufsize=65536
     )
 
     state = {
@@ -54,15 +76,20 @@ def main():
     }
 
     last_good_track = None
+    last_write = 0.0
+    dirty = False                   # PPS/SKY change not yet written
 
     for line in gps.stdout:
+        # skip VERSION / DEVICES / WATCH / ATT etc. without parsing them
+        cls = line_class(line)
+        if cls not in HANDLED_CLASSES:
+            continue
+
         try:
-            msg = json.loads(line)
+            msg = json_loads(line)
         except Exception:
             continue
 
-        cls = msg.get("class")
-
         # --------------------------------------------------
         # PPS (timing only)
         # --------------------------------------------------
@@ -72,14 +99,19 @@ def main():
             if sec is not None and nsec is not None:
                 state["pps_epoch"] = sec + (nsec / 1e9)
                 state["pps_ok"] = True
+                dirty = True
 
         # --------------------------------------------------
         # SKY (satellites only)
         # --------------------------------------------------
         elif cls == "SKY":
             sats = msg.get("satellites", [])
-            state["sats"] = len(sats)
-            state["prns"] = [s.get("svid") for s in sats if s.get("used")]
+            prns = [s.get("svid") for s in sats if s.get("used")]
+            # gpsd repeats SKY often with the same constellation
+            if len(sats) != state["sats"] or prns != state["prns"]:
+                state["sats"] = len(sats)
+                state["prns"] = prns
+                dirty = True
 
         # --------------------------------------------------
         # TPV (position + motion authority)
@@ -114,11 +146,15 @@ def main():
 
         # --------------------------------------------------
         # WRITE (always atomic, always last-known-good)
+        # TPV is written immediately; PPS/SKY updates are coalesced and
+        # only written when they changed something.
         # --------------------------------------------------
-        state["ts_utc"] = utc_iso()
-        atomic_write_json(OUT, state)
-
-        time.sleep(WRITE_INTERVAL)
+        now = time.monotonic()
+        if cls == "TPV" or (dirty and (now - last_write) >= WRITE_INTERVAL):
+            state["ts_utc"] = utc_iso()
+            atomic_write_json(OUT, state)
+            last_write = now
+            dirty = False
 
 if __name__ == "__main__":
     main()
@@ -1,17 +1,23 @@
-# system_monitor.py  (writes tmp/system.json; NO DB)
 #!/usr/bin/env python3
+# system_monitor.py  (writes tmp/system.json; NO DB)
 import os
 import time
 import json
 import shutil
 
+try:
+    from orjson import dumps as json_dumps
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
 BASE = "/media/sbejarano/Developer1/wifi_promiscuous"
 OUT  = f"{BASE}/tmp/system.json"
 
 def atomic_write_json(path, obj):
     tmp = path + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(obj, f, separators=(",", ":"))
+    with open(tmp, "wb") as f:
+        f.write(json_dumps(obj))
     os.replace(tmp, path)
 
 def read_cpu_temp_c():
@@ -47,7 +53,13 @@ def read_mem():
     except Exception:
         return None
 
+INTERVAL_S = 1.0
+
 def main():
+    # schedule on the monotonic clock so the 1 Hz cadence does not drift
+    # by the time spent sampling and writing
+    next_tick = time.monotonic()
+
     while True:
         du = shutil.disk_usage(BASE)
         payload = {
@@ -63,7 +75,14 @@ def main():
             "cpu_temp_c": read_cpu_temp_c()
         }
         atomic_write_json(OUT, payload)
-        time.sleep(1.0)
+
+        next_tick += INTERVAL_S
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # fell behind (suspend, slow disk): resync instead of bursting
+            next_tick = time.monotonic()
 
 if __name__ == "__main__":
     main()
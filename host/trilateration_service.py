@@ -5,6 +5,14 @@ import math
 import os
 from collections import deque
 
+try:
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
 # INPUT from capture (RAM snapshot)
 SRC = "/dev/shm/wifi_capture.json"
 
@@ -85,8 +93,8 @@ def haversine_m(lat1, lon1, lat2, lon2):
 
 def atomic_write(path, obj):
     tmp = path + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(obj, f)
+    with open(tmp, "wb") as f:
+        f.write(json_dumps(obj))
     os.replace(tmp, path)
 
 def now_ts():
@@ -106,8 +114,8 @@ def main():
     while True:
         # Read capture snapshot
         try:
-            with open(SRC) as f:
-                data = json.load(f)
+            with open(SRC, "rb") as f:
+                data = json_loads(f.read())
         except Exception:
             time.sleep(0.2)
             continue
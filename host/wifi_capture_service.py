@@ -1,13 +1,27 @@
-# wifi_capture_service.py  (RAM snapshot only; NO DB)
 #!/usr/bin/env python3
+# wifi_capture_service.py  (RAM snapshot only; NO DB)
 import os
 import time
 import json
+import selectors
 import serial
 import threading
 import yaml
 from collections import deque
 
+try:
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 BASE = "/media/sbejarano/Developer1/wifi_promiscuous"
 CFG  = f"{BASE}/host/devices.yaml"
 GPS  = f"{BASE}/tmp/gps.json"
@@ -18,11 +32,39 @@ OUT  = "/dev/shm/wifi_capture.json"
 BAUD_DEFAULT = 115200
 MAX_OBS = 400          # hard cap per snapshot
 FLUSH_MS = 200         # write snapshot every N ms
+OPEN_RETRY_S = 2.0     # wait after a failed open
+RECONNECT_S = 1.0      # wait after a port drops
+LOST_LOG_S = 5.0       # report ring overflows at most this often
+
+# 2.4 GHz channel -> centre frequency (MHz); index 0 is unused
+FREQ_BY_CH = (
+    None,
+    2412, 2417, 2422, 2427, 2432, 2437, 2442,
+    2447, 2452, 2457, 2462, 2467, 2472, 2484,
+)
+
+# The same APs are heard over and over; reuse one str object per BSSID /
+# SSID instead of keeping a fresh copy in every buffered observation.
+STR_POOL_LIMIT = 4096
+_str_pool = {}
+
+def pooled(s):
+    v = _str_pool.get(s)
+    if v is None:
+        if len(_str_pool) >= STR_POOL_LIMIT:
+            _str_pool.clear()
+        _str_pool[s] = v = s
+    return v
+
+def freq_from_channel(ch):
+    return FREQ_BY_CH[ch] if 0 < ch < len(FREQ_BY_CH) else None
 
 def atomic_write_json(path, obj):
+    # encoded in one call to bytes, then written with a single f.write()
+    data = json_dumps(obj)
     tmp = path + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(obj, f, separators=(",", ":"))
+    with open(tmp, "wb") as f:
+        f.write(data)
     os.replace(tmp, path)
 
 def load_ports():
@@ -33,7 +75,7 @@ def load_ports():
     Returns list of dicts: {node, port, baud}
     """
     with open(CFG) as f:
-        conf = yaml.safe_load(f) or {}
+        conf = yaml.load(f, Loader=YamlLoader) or {}
 
     ports = []
 
@@ -67,90 +109,204 @@ def load_ports():
 
     return ports
 
+# gps.json is replaced at most ~20x/s; only re-parse it when it changed.
+#
+# Change check used by every host script that polls an atomically
+# replaced JSON file (here, broker, ap_position_writer, esp_usb_watchdog):
+# stat the file and compare (st_ino, st_mtime_ns) with the key of the last
+# successful parse; the key is only stored after that parse succeeds, so a
+# failed read is retried on the next poll. Two replacements within one
+# kernel tick can share an mtime, and os.replace usually (not always --
+# ext4 reuses freed inode numbers) gives the file a new inode, so the pair
+# catches far more replacements than the mtime alone.
+_gps_key = None
+_gps_cache = None
+
 def read_gps():
+    global _gps_key, _gps_cache
+
     try:
-        with open(GPS) as f:
-            return json.load(f)
+        st = os.stat(GPS)
+        key = (st.st_ino, st.st_mtime_ns)
+        if key != _gps_key:
+            _gps_key = None
+            with open(GPS, "rb") as f:
+                _gps_cache = json_loads(f.read())
+            _gps_key = key
     except Exception:
-        return None
+        _gps_key = None
+        _gps_cache = None
+
+    return _gps_cache
 
 class CaptureBus:
+    # One reader thread appends, the main thread snapshots. deque.append
+    # and list(deque) each run entirely in C under the GIL, so no lock is
+    # needed around them.
     def __init__(self):
-        self.lock = threading.Lock()
         self.buf = deque(maxlen=MAX_OBS)
+        self.added = 0      # total appended; only the reader thread writes it
 
     def add(self, obs):
-        with self.lock:
-            self.buf.append(obs)
+        self.buf.append(obs)
+        self.added += 1
 
     def snapshot(self):
-        with self.lock:
-            return list(self.buf)
+        return list(self.buf)
+
+def handle_line(bus: CaptureBus, node: str, raw: bytes):
+    # Both orjson and json accept the raw bytes, so there is no
+    # separate decode pass per line.
+    raw = raw.strip()
+    if not raw.startswith(b"{"):
+        return
+
+    try:
+        pkt = json_loads(raw)
+    except Exception:
+        return
+
+    get   = pkt.get
+    bssid = pooled((get("bssid") or "").strip())
+    ssid  = pooled((get("ssid") or "").strip())
+    rssi  = get("rssi")
+    ch    = get("ch") or get("chan") or get("channel")
+    freq  = get("freq") or get("frequency")
+
+    if not bssid or rssi is None:
+        return
+
+    # firmware sends ints; only strings need the digit check
+    if isinstance(ch, str):
+        ch = int(ch) if ch.isdigit() else ch
+    if type(ch) is int:
+        if not freq:
+            freq = freq_from_channel(ch)
+
+    obs = {
+        "ts": time.time(),     # PPS-disciplined system time
+        "node": node,          # already str, see capture_loop
+        "bssid": bssid,
+        "ssid": ssid,
+        "rssi": rssi if type(rssi) is int else int(rssi),
+        "channel": ch,
+        "frequency": freq
+    }
+
+    bus.add(obs)
+
+def capture_loop(bus: CaptureBus, ports):
+    """
+    Single reader for every probe port: one selector (epoll on Linux)
+    instead of one blocking thread per serial device.
+    """
+    sel = selectors.DefaultSelector()
+    select, read, handle = sel.select, os.read, handle_line
+
+    # port index -> earliest time to (re)open it
+    retry_at = {i: 0.0 for i in range(len(ports))}
 
-def capture_thread(bus: CaptureBus, node: str, dev: str, baud: int):
     while True:
-        try:
-            ser = serial.Serial(dev, baud, timeout=0.15)
-        except Exception:
-            time.sleep(2)
-            continue
+        now = time.time()
 
-        while True:
+        for i, at in list(retry_at.items()):
+            if now < at:
+                continue
+
+            p = ports[i]
             try:
-                raw = ser.readline().decode(errors="ignore").strip()
-                if not raw.startswith("{"):
-                    continue
+                ser = serial.Serial(p["port"], p["baud"], timeout=0)
+            except Exception:
+                retry_at[i] = now + OPEN_RETRY_S
+                continue
 
-                pkt = json.loads(raw)
+            del retry_at[i]
+            sel.register(
+                ser.fileno(),
+                selectors.EVENT_READ,
+                data=(i, str(p["node"]), ser, bytearray())
+            )
 
-                bssid = (pkt.get("bssid") or "").strip()
-                ssid  = (pkt.get("ssid") or "").strip()
-                rssi  = pkt.get("rssi")
-                ch    = pkt.get("ch") or pkt.get("chan") or pkt.get("channel")
-                freq  = pkt.get("freq") or pkt.get("frequency")
+        # Block until a port has data; only wake on a timer when a port
+        # is waiting to be reopened.
+        if retry_at:
+            timeout = max(0.0, min(retry_at.values()) - time.time())
+        else:
+            timeout = None
 
-                if not bssid or rssi is None:
-                    continue
+        for key, _ in select(timeout=timeout):
+            i, node, ser, buf = key.data
 
-                obs = {
-                    "ts": time.time(),     # PPS-disciplined system time
-                    "node": str(node),
-                    "bssid": bssid,
-                    "ssid": ssid,
-                    "rssi": int(rssi),
-                    "channel": int(ch) if ch is not None and str(ch).isdigit() else ch,
-                    "frequency": freq
-                }
+            try:
+                chunk = read(key.fd, 4096)
+            except BlockingIOError:
+                continue
+            except OSError:
+                chunk = b""
+
+            if not chunk:
+                # readable but empty: device unplugged or reset
+                sel.unregister(key.fd)
+                try:
+                    ser.close()
+                except Exception:
+                    pass
+                retry_at[i] = time.time() + RECONNECT_S
+                continue
 
-                bus.add(obs)
+            buf.extend(chunk)
 
-            except Exception:
-                break
+            if b"\n" not in chunk:
+                continue
 
-        try:
-            ser.close()
-        except Exception:
-            pass
+            # one split per read; the unterminated tail stays buffered
+            *lines, tail = buf.split(b"\n")
+            buf[:] = tail
 
-        time.sleep(1)
+            for line in lines:
+                # one bad line (wrong field types, stray bytes) must not
+                # end the only thread that reads every probe
+                try:
+                    handle(bus, node, line)
+                except Exception:
+                    continue
 
 def main():
     ports = load_ports()
     bus = CaptureBus()
 
-    for p in ports:
-        threading.Thread(
-            target=capture_thread,
-            args=(bus, p["node"], p["port"], p["baud"]),
-            daemon=True
-        ).start()
+    threading.Thread(
+        target=capture_loop,
+        args=(bus, ports),
+        daemon=True
+    ).start()
+
+    # Observations that fell out of the ring before any snapshot saw them
+    last_added = 0
+    lost_obs = 0
+    logged_lost = 0
+    last_lost_log = 0.0
 
     while True:
         time.sleep(FLUSH_MS / 1000.0)
 
         gps = read_gps()
+        added = bus.added
         snap = bus.snapshot()
 
+        lost_obs += max(0, added - last_added - MAX_OBS)
+        last_added = added
+
+        now = time.monotonic()
+        if lost_obs > logged_lost and now - last_lost_log >= LOST_LOG_S:
+            print(
+                f"[wifi_capture] ring overflow: {lost_obs - logged_lost} "
+                f"observations lost ({lost_obs} total)",
+                flush=True
+            )
+            logged_lost = lost_obs
+            last_lost_log = now
+
         if len(snap) > MAX_OBS:
             snap = snap[-MAX_OBS:]
 
@@ -169,6 +325,7 @@ def main():
         payload = {
             "ts": time.time(),
             "gps": gps_block,
+            "lost_obs": lost_obs,
             "observations": snap
         }
 
@@ -19,6 +19,9 @@ const MAX_LR_CYCLES      = 6;    // LEFT / RIGHT
 const LR_CYCLE_MS        = 8000; // 8-s window
 const HYBRID_WINDOW_MS   = 3000; // 3-s speed buffer
 
+// heartbeat keys shown in the GPS panel (nodes 1-12 + named nodes)
+const HB_KEYS = [...Array.from({ length: 12 }, (_, i) => String(i + 1)), "gps","GPS","LEFT","RIGHT","pps","PPS"];
+
 /* ---------- caches ---------- */
 const leftCycles   = new Map(); // cycle -> Map<bssid, record>
 const rightCycles  = new Map();
@@ -46,7 +49,9 @@ function fixDec(v, decimals = 6) {
 
 async function fetchJSON(url) {
   try {
-    const res = await fetch(url, { cache: "no-store" });
+    // "no-cache" still revalidates every poll, but an unchanged file comes
+    // back as a 304 served from the HTTP cache instead of a full transfer
+    const res = await fetch(url, { cache: "no-cache" });
     if (!res.ok) return null;
     return await res.json();
   } catch {
@@ -135,7 +140,6 @@ function renderGPS(gps, system) {
   const alt  = (altN === null) ? "---" : altN.toFixed(1);
 
   const hb = (system && system.heartbeat) ? system.heartbeat : {};
-  const hbKeys = [...Array.from({ length: 12 }, (_, i) => String(i + 1)), "gps","GPS","LEFT","RIGHT","pps","PPS"];
 
   function hbDot(ts) {
     const t = toNum(ts);
@@ -156,7 +160,7 @@ function renderGPS(gps, system) {
       <div class="k">Alt:</div><div class="v">${alt}</div>
     </div>
     <div class="hb-title">ESP32 Heartbeat</div>
-    ${hbKeys.map(k => `<div class="hb-row"><span>Node ${k}:</span>${hbDot(hb[k])}</div>`).join("")}`;
+    ${HB_KEYS.map(k => `<div class="hb-row"><span>Node ${k}:</span>${hbDot(hb[k])}</div>`).join("")}`;
 }
 
 function sortByRssiDesc(arr) {
@@ -208,6 +212,17 @@ function renderHybrid(cache) {
     </table>`;
 }
 
+/* ---------- paint ---------- */
+const lastHtml = new Map(); // panel id -> last rendered HTML
+
+// Only touch the DOM when a panel's markup actually changed; an idle
+// panel then costs no re-parse, layout or lost text selection.
+function paint(id, html) {
+  if (lastHtml.get(id) === html) return;
+  lastHtml.set(id, html);
+  document.getElementById(id).innerHTML = html;
+}
+
 /* ---------- polling ---------- */
 async function pollOnce() {
   const [gps, system] = await Promise.all([
@@ -235,10 +250,10 @@ async function pollOnce() {
   const cacheHybrid = buildHybridCache();
 
   /* ----- paint ----- */
-  document.getElementById("gps-panel").innerHTML    = renderGPS(gps, system);
-  document.getElementById("left-panel").innerHTML   = renderDirectional("LEFT", cacheLeft);
-  document.getElementById("right-panel").innerHTML  = renderDirectional("RIGHT", cacheRight);
-  document.getElementById("hybrid-panel").innerHTML = renderHybrid(cacheHybrid);
+  paint("gps-panel",    renderGPS(gps, system));
+  paint("left-panel",   renderDirectional("LEFT", cacheLeft));
+  paint("right-panel",  renderDirectional("RIGHT", cacheRight));
+  paint("hybrid-panel", renderHybrid(cacheHybrid));
 }
 
 /* ---------- DB button → systemd ---------- */
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 import subprocess
 import yaml
-import re
-import os
+
+try:
+    from yaml import CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeDumper as YamlDumper
 
 OUT = "/media/sbejarano/Developer1/wifi_promiscuous/host/devices.yaml"
 
@@ -99,7 +102,7 @@ def main():
     config = build_yaml(devs)
 
     with open(OUT, "w") as f:
-        yaml.dump(config, f, default_flow_style=False)
+        yaml.dump(config, f, Dumper=YamlDumper, default_flow_style=False)
 
     print("[build_devices_yaml] devices.yaml written.")
 